@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 import logging
+import hashlib
 import json
+import os
 import tomllib
 import shutil
+import stat
 import sys
+import threading
+import weakref
 import xml.etree.ElementTree as ET
 
 from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
-from mib.utils import pkgbuild, productbuild, working_directory, installer
+from mib.utils import pkgbuild, productbuild, installer
 
 logger = logging.getLogger(__file__)
 # logger.setLevel(logging.ERROR)
@@ -20,35 +28,283 @@ logging.basicConfig(
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape, exceptions as jinja2_exc
 
-resources_path = (Path("_files") / "Resources" / "en.lproj").resolve()
+resources_path = Path("_files") / "Resources"
 templates_path = Path("templates").resolve()
+BINARY_RESOURCE_SUFFIXES = (".png", ".jpg", ".jpeg", ".tiff", ".icns", ".pdf")
 # working_directory = Path(__file__).parent
 
 
-env = Environment(
-    loader=FileSystemLoader(templates_path),
-    autoescape=select_autoescape()
-)
+class BuildError(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def template_environment(templates_dir: Path):
+    """Returns jinja2 environment for templates dir, shared between builds so compiled templates are reused."""
+    return Environment(
+        loader=FileSystemLoader(templates_dir),
+        autoescape=select_autoescape()
+    )
+
+
+env = template_environment(templates_path)
+
+
+class BuildCache:
+    """Keeps built component packages and template usage between builds of long-living process (see `mib serve`)."""
+
+    def __init__(self, directory, max_components=64):
+        self.directory = Path(directory)
+        self.max_components = max_components
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    def _record(self, kind, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[kind] += 1
+
+    def component(self, key, dst_path):
+        """Copies cached component package to `dst_path`, returns its files manifest or None if not cached.
+
+        Lookup and copy are done under lock, so the package can't be evicted by another build in between.
+        """
+        pkg_path = self.directory / f"{key}.pkg"
+        manifest_path = self.directory / f"{key}.json"
+        with self._lock:
+            try:
+                files = json.loads(manifest_path.read_text())
+                shutil.copy2(pkg_path, dst_path)
+                # mtime marks last use, least recently used packages are evicted first
+                os.utime(pkg_path)
+            except FileNotFoundError:
+                files = None
+        self._record("components", files is not None)
+        return files
+
+    def store_component(self, key, pkg_path, files):
+        tmp_paths = []
+        for cached_path, write in (
+            (self.directory / f"{key}.json", lambda path: path.write_text(json.dumps(files))),
+            (self.directory / f"{key}.pkg", lambda path: shutil.copy2(pkg_path, path)),
+        ):
+            tmp_path = cached_path.with_name(f"{cached_path.name}.{threading.get_ident()}.tmp")
+            write(tmp_path)
+            tmp_paths.append((tmp_path, cached_path))
+        with self._lock:
+            for tmp_path, cached_path in tmp_paths:
+                os.replace(tmp_path, cached_path)
+            os.utime(self.directory / f"{key}.pkg")
+            self._evict()
+
+    def _evict(self):
+        """Removes least recently used component packages above `max_components`, called under lock."""
+        packages = []
+        for pkg_path in self.directory.glob("*.pkg"):
+            try:
+                packages.append((pkg_path.stat().st_mtime_ns, pkg_path))
+            except FileNotFoundError:
+                continue
+        packages.sort(reverse=True)
+        for _, pkg_path in packages[self.max_components:]:
+            pkg_path.unlink(missing_ok=True)
+            pkg_path.with_suffix(".json").unlink(missing_ok=True)
 
-def fill_template(file_path, values: dict):
-    tmpl_name = Path(file_path).name
-    template = env.get_template(tmpl_name)
+    def template(self, hit):
+        """Records whether compiled template was reused from jinja2 environment cache or (re)compiled."""
+        self._record("templates", hit)
+
+    def stats(self):
+        with self._lock:
+            return {
+                kind: {"hits": self.hits[kind], "misses": self.misses[kind]}
+                for kind in ("components", "templates")
+            }
+
+
+def component_fingerprint(params: dict) -> str:
+    """Hash of pkgbuild params and stat info of every file in component root and scripts dir."""
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    for key in ("root", "scripts"):
+        if key not in params:
+            continue
+        for path in sorted(Path(params[key]).rglob("*")):
+            stat_result = path.lstat()
+            digest.update(
+                f"{path}:{stat_result.st_mode}:{stat_result.st_size}:{stat_result.st_mtime_ns}\n".encode()
+            )
+    return digest.hexdigest()
+
+
+def component_files(root) -> list:
+    """Manifest entries (relative path, mode, size, sha256) of every file installed from component root."""
+    files = []
+    root = Path(root)
+    for path in sorted(root.rglob("*")):
+        if path.is_symlink() or not path.is_file():
+            continue
+        with open(path, "rb") as file:
+            sha256 = hashlib.file_digest(file, "sha256").hexdigest()
+        stat_result = path.stat()
+        files.append({
+            "path": str(path.relative_to(root)),
+            "mode": oct(stat.S_IMODE(stat_result.st_mode)),
+            "size": stat_result.st_size,
+            "sha256": sha256,
+        })
+    return files
+
+
+def _compiled_templates(environment, names) -> dict:
+    """Returns {name: compiled template or None} currently held in jinja2 environment cache."""
+    if environment.cache is None:
+        return {}
+    # same key jinja2 Environment uses for its template cache
+    loader_ref = weakref.ref(environment.loader)
+    return {name: environment.cache.get((loader_ref, name)) for name in names}
+
+
+def fill_template(
+    file_path, values: dict, environment=env, cache=None, locale=None, output_path=None, base_fallback=True,
+    tmpl_name=None
+):
+    """Renders template named as file (localized one from templates/<locale>.lproj first) into output path.
+
+    Not localized template is used only when `base_fallback` is set.
+    """
+    tmpl_name = tmpl_name or Path(file_path).name
+    candidates = [f"{locale}.lproj/{tmpl_name}"] if locale else []
+    if base_fallback or not locale:
+        candidates.append(tmpl_name)
+    compiled = _compiled_templates(environment, candidates) if cache is not None else {}
+    template = environment.select_template(candidates)
+    if cache is not None:
+        # same object as before lookup means compiled template was reused, not recompiled or reloaded
+        cache.template(hit=compiled.get(template.name) is template)
     # breakpoint()
-    with open(file_path, "w") as file:
-        logger.info(f"Processing template: {file_path}")
-        file.write(
-            template.render(**values)
-        )
+    output_path = output_path or file_path
+    logger.info(f"Processing template: {output_path}")
+    rendered = template.render(**values)
+    with open(output_path, "w") as file:
+        file.write(rendered)
 
 
-def fill_templates(tmpl_dir, values: dict):
-    for file_path in Path(tmpl_dir).glob("**/*"):
+def discover_locales(resources_dir) -> dict:
+    """Returns {locale: lproj dir} found in resources dir (or in its parent if it is .lproj dir itself)."""
+    resources_dir = Path(resources_dir)
+    if resources_dir.suffix == ".lproj":
+        resources_dir = resources_dir.parent
+    return {
+        lproj_dir.stem: lproj_dir
+        for lproj_dir in sorted(resources_dir.glob("*.lproj"))
+        if lproj_dir.is_dir()
+    }
+
+
+def merge_values(values: dict, overrides: dict) -> dict:
+    merged = dict(values)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = merge_values(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def link_asset(src_path, dst_path, linked: dict):
+    """Hardlinks asset into build resources, same content in several locales ends up as one inode."""
+    with open(src_path, "rb") as file:
+        digest = hashlib.file_digest(file, "sha256").hexdigest()
+    if digest in linked:
+        os.link(linked[digest], dst_path)
+        return
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        # build dir is on another filesystem, copy once, link the rest to the copy
+        shutil.copy2(src_path, dst_path)
+    linked[digest] = dst_path
+
+
+def _render_resource(src_path, dst_path, values, locale, tmpl_name, environment, resources_environment, cache,
+                     default_locale):
+    """Renders localized resource, returns False for assets which should be linked as is.
+
+    Template is looked up in templates/<locale>.lproj, then in templates (for default locale only),
+    otherwise resource file itself is rendered as template, for every locale the same way.
+    Files which can't be decoded as text are assets, template errors fail the build.
+    """
+    if src_path.suffix in BINARY_RESOURCE_SUFFIXES:
+        return False
+    try:
         try:
-            if file_path.is_dir() or file_path.suffix == ".png":
-                continue
-            fill_template(file_path, values=values)
+            fill_template(
+                src_path, values=values, environment=environment, cache=cache, locale=locale, output_path=dst_path,
+                base_fallback=locale == default_locale, tmpl_name=tmpl_name
+            )
         except jinja2_exc.TemplateNotFound:
+            fill_template(
+                src_path, values=values, environment=resources_environment, cache=cache, locale=locale,
+                output_path=dst_path, base_fallback=False, tmpl_name=tmpl_name
+            )
+    except UnicodeDecodeError:
+        logger.info(f"Not a text resource, linking as is: {src_path}")
+        return False
+    except jinja2_exc.TemplateError as e:
+        raise BuildError(f"Can't render resource {src_path}: {e}") from e
+    return True
+
+
+def fill_templates(
+    resources_dir, build_resources_dir, values: dict, locales_values=None, environment=env, cache=None,
+    default_locale="en"
+):
+    """Renders every locale x resource pair of resources dir into build resources dir on thread pool.
+
+    All renders share one environment, so each template is compiled once whatever the number of locales.
+    Locales are *.lproj dirs (see `discover_locales`), files outside of them are shared assets.
+    `locales_values` are per-locale overrides of values, keyed by locale (lproj dir name without suffix).
+    Assets are hardlinked instead of copied.
+    """
+    resources_dir = Path(resources_dir)
+    if resources_dir.suffix == ".lproj":
+        resources_dir = resources_dir.parent
+    build_resources_dir = Path(build_resources_dir)
+    shutil.rmtree(build_resources_dir, ignore_errors=True)
+    locales_values = locales_values or {}
+    resources_environment = template_environment(resources_dir.resolve())
+    locales = discover_locales(resources_dir)
+
+    jobs = []
+    assets = []
+    for locale, lproj_dir in locales.items():
+        locale_values = merge_values({**values, 'locale': locale}, locales_values.get(locale, {}))
+        for src_path in sorted(lproj_dir.rglob("*")):
+            if src_path.is_dir():
+                continue
+            dst_path = build_resources_dir / src_path.relative_to(resources_dir)
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+            jobs.append((src_path, dst_path, locale_values, locale, src_path.relative_to(lproj_dir).as_posix()))
+    lproj_names = {lproj_dir.name for lproj_dir in locales.values()}
+    for src_path in sorted(resources_dir.rglob("*")):
+        relative_path = src_path.relative_to(resources_dir)
+        if src_path.is_dir() or relative_path.parts[0] in lproj_names:
             continue
+        dst_path = build_resources_dir / relative_path
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        assets.append((src_path, dst_path))
+
+    with ThreadPoolExecutor(thread_name_prefix="mib-render") as executor:
+        rendered = list(executor.map(
+            lambda job: _render_resource(*job, environment, resources_environment, cache, default_locale),
+            jobs
+        ))
+
+    assets += [(job[0], job[1]) for job, is_rendered in zip(jobs, rendered) if not is_rendered]
+    linked = {}
+    for src_path, dst_path in assets:
+        link_asset(src_path, dst_path, linked)
+    return build_resources_dir
 
 
 def parse_args():
@@ -56,25 +312,81 @@ def parse_args():
         description="Makes application installer from config",
         usage="\n\nExample:\n\tmib2 --config mib.toml",
     )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="build",
+        choices=["build", "serve", "submit", "metrics", "verify"],
+        help="build installer locally (default), run build server, submit builds to it, show its metrics "
+             "or verify installation"
+    )
     parser.add_argument(
         "-c", "--config",
-        action="store",
-        default="mib.toml",
+        action="append",
         # required=True,
-        help="mib json (or toml) config path"
+        help="mib json (or toml) config path, can be repeated to submit several builds at once"
+    )
+    parser.add_argument(
+        "-s", "--socket",
+        action="store",
+        default=None,
+        help="build server unix socket path"
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        action="store",
+        type=int,
+        default=None,
+        help="build server (default: 2) or verifier worker pool size"
+    )
+    parser.add_argument(
+        "--queue-size",
+        action="store",
+        type=int,
+        default=32,
+        help="max builds waiting in build server queue"
+    )
+    parser.add_argument(
+        "--cache-size",
+        action="store",
+        type=int,
+        default=64,
+        help="max component packages kept in build server cache, least recently used are removed"
+    )
+    parser.add_argument(
+        "--inline",
+        action="store_true",
+        help="send config contents instead of config path to build server"
+    )
+    parser.add_argument(
+        "-m", "--manifest",
+        action="store",
+        default=None,
+        help="build manifest to verify installation against (default: <installer file-name>.manifest.json)"
+    )
+    parser.add_argument(
+        "--target-root",
+        action="store",
+        default="/",
+        help="root of installation to verify"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        action="store",
+        default=None,
+        help="write verification report json to this path instead of stdout"
     )
     return parser.parse_args()
 
 
 def load_config(config_path="mib.json"):
+    config_path = Path(config_path)
+    if config_path.suffix not in (".json", ".toml"):
+        raise BuildError("This config is not supported! (only json, toml files are supported)")
     with open(config_path, "rb") as file:
         if config_path.suffix == ".json":
             return json.load(file)
-        elif config_path.suffix == ".toml":
-            return tomllib.load(file)
-        else:
-            sys.stderr.write("This config is not supported! (only json, toml files are supported)\n")
-            exit(1)
+        return tomllib.load(file)
 
 def modify_distribution_xml(file_path, params):
     tree = ET.parse(file_path)
@@ -101,24 +413,23 @@ def modify_distribution_xml(file_path, params):
                     elem.set(attr, val)
     tree.write(file_path)
 
-def working_dir_path(path, as_path: bool = False) -> str:
-    resolved_path = (Path(__file__).parent / Path(path)).resolve()
-    if as_path:
-        return resolved_path
-    return str(resolved_path)
+def _check_result(result, what):
+    if result.error:
+        raise BuildError(f"{what} failed: {result.stderr}")
+    return result
 
-def build_dir_path(path):
-    build_dir = Path(__file__).parent / "build"
-    build_dir.mkdir(exist_ok=True, parents=True)
-    return str((build_dir / Path(path)).resolve())
 
-def main():
-    args = parse_args()
-    config = load_config(config_path=Path(args.config))
+def build_installer(config, base_dir, build_dir=None, output_dir=None, cache=None, progress=None):
+    """Builds installer from config, returns path of built installer.
 
-    if sys.platform != "darwin":
-        sys.stderr.write("Sorry, Mac OS Installer Builder is available only on Mac OS system!\n")
-        exit(1)
+    Relative paths from config are resolved against `base_dir`. Doesn't change working directory,
+    so several builds can run in one process at the same time given they use different `build_dir`.
+    """
+    base_dir = Path(base_dir).resolve()
+    build_dir = Path(build_dir or base_dir / "build").resolve()
+    output_dir = Path(output_dir or base_dir).resolve()
+    build_dir.mkdir(exist_ok=True, parents=True)
+    progress = progress or logger.info
 
     product_config = config.get("product", {})
     product_identifier = product_config.get("identifier")
@@ -129,71 +440,163 @@ def main():
 
     check_installer = installer_config.get("check-after-build", False)
     installer_name = installer_config.get("file-name")
-    resources_dir = installer_config.get("resources-dir")
+    resources_dir = base_dir / installer_config.get("resources-dir", resources_path)
+    templates_dir = (base_dir / installer_config.get("templates-dir", "templates")).resolve()
 
     distribution_params = installer_config.get("distribution")
-    
+
     config_files = installer_config.get("files", [])
     packages_list = []
+    components_manifest = []
     for file in config_files:
         file_name = file.get("name")
         root = file.get("root")
         install_location = file.get("install-location")
+        pkg_name = f"{product_name}-{file_name}.pkg"
         pkgbuild_params = dict(
-            root=working_dir_path(root),
+            root=str(base_dir / root),
             identifier=f"{product_identifier}-{file_name}",
             version=product_version,
             install_location=install_location
         )
         if file.get("scripts-dir"):
-            pkgbuild_params.update({'scripts': working_dir_path(file.get("scripts-dir"))})
-        with working_directory("build"):
-            pkgbuild(
-                f"{product_name}-{file_name}.pkg",
-                **pkgbuild_params
-            )
-        packages_list.append(f"{product_name}-{file_name}.pkg")
+            pkgbuild_params.update({'scripts': str(base_dir / file.get("scripts-dir"))})
 
-    # dist_xml_path = str((build_path / ).resolve())
-    # breakpoint()
-    # os.chdir(build_path)
-    with working_directory("build"):
+        cache_key = component_fingerprint(pkgbuild_params) if cache is not None else None
+        (build_dir / pkg_name).unlink(missing_ok=True)
+        files = cache.component(cache_key, build_dir / pkg_name) if cache is not None else None
+        if files is not None:
+            progress(f"Reusing cached component package: {pkg_name}")
+        else:
+            progress(f"Building component package: {pkg_name}")
+            _check_result(pkgbuild(pkg_name, **pkgbuild_params, cwd=build_dir), "pkgbuild")
+            files = component_files(pkgbuild_params["root"])
+            if cache is not None:
+                cache.store_component(cache_key, build_dir / pkg_name, files)
+        packages_list.append(pkg_name)
+        components_manifest.append({
+            "name": file_name,
+            "identifier": pkgbuild_params["identifier"],
+            "version": product_version,
+            "install-location": install_location,
+            "files": files,
+        })
+
+    progress("Synthesizing distribution")
+    _check_result(
         productbuild(
             f"{product_name}-distribution.xml",
             packages=packages_list,
-            synthesize=True
-        )
-        # modifying distribution xml
-        modify_distribution_xml(
-            f"{product_name}-distribution.xml",
-            params=distribution_params
-        )
+            synthesize=True,
+            cwd=build_dir
+        ),
+        "productbuild"
+    )
+    # modifying distribution xml
+    modify_distribution_xml(
+        build_dir / f"{product_name}-distribution.xml",
+        params=distribution_params
+    )
 
-    # fill html templates based on params
-    fill_templates(
-        working_dir_path(resources_path),
-        values={'product': product_config}
+    # fill html templates of every locale based on params, into build dir so that builds do not touch each other
+    locales = discover_locales(resources_dir)
+    progress(f"Rendering resources for locales: {', '.join(locales) or 'none'}")
+    build_resources_dir = fill_templates(
+        resources_dir,
+        build_dir / "Resources",
+        values={'product': product_config},
+        locales_values={
+            locale: {'product': overrides}
+            for locale, overrides in installer_config.get("locales", {}).items()
+        },
+        environment=template_environment(templates_dir),
+        cache=cache,
+        default_locale=installer_config.get("default-locale", "en")
     )
-    
-    with working_directory("build"):
+
+    progress("Building product archive")
+    (build_dir / f"{installer_name}.pkg").unlink(missing_ok=True)
+    _check_result(
         productbuild(
             f"{installer_name}.pkg",
             distribution=f"{product_name}-distribution.xml",
-            resources=working_dir_path(resources_dir)
-        )
-    # print(f"{os.getcwd()=}") 
-    
-    working_dir_path(f"{installer_name}.pkg", as_path=True).unlink(missing_ok=True)
-    shutil.move(build_dir_path(f"{installer_name}.pkg"), Path(__file__).parent)
+            resources=str(build_resources_dir),
+            cwd=build_dir
+        ),
+        "productbuild"
+    )
 
-    logger.info("Installer generating process finished")
+    installer_path = output_dir / f"{installer_name}.pkg"
+    installer_path.unlink(missing_ok=True)
+    shutil.move(build_dir / f"{installer_name}.pkg", installer_path)
+
+    # build manifest of installed components, used by `mib verify` after install
+    manifest_path = output_dir / f"{installer_name}.manifest.json"
+    manifest_path.write_text(json.dumps({
+        "product": {"name": product_name, "identifier": product_identifier, "version": product_version},
+        "components": components_manifest,
+        "verify": installer_config.get("verify", {}),
+    }, indent=2))
+
+    progress("Installer generating process finished")
     if check_installer:
-        logger.info("Checking installer")
-        installer(
-            pkg=f"{installer_name}.pkg",
-            target="/",
-            dumplog=True
+        progress("Checking installer")
+        _check_result(
+            installer(
+                pkg=str(installer_path),
+                target="/",
+                dumplog=True
+            ),
+            "installer"
+        )
+    return installer_path
+
+
+def run_verify(args, config_path):
+    from mib.verify import run
+
+    return run(
+        config_path=config_path,
+        manifest_path=args.manifest,
+        target_root=args.target_root,
+        workers=args.workers,
+        output=args.output,
+    )
+
+
+def main():
+    args = parse_args()
+    config_paths = [Path(path) for path in args.config or ["mib.toml"]]
+
+    if args.command in ("submit", "metrics"):
+        from mib.server import submit, show_metrics
+        if args.command == "metrics":
+            exit(show_metrics(socket_path=args.socket))
+        exit(submit(config_paths, socket_path=args.socket, inline=args.inline))
+
+    if args.command == "verify":
+        exit(run_verify(args, config_paths[0]))
+
+    if sys.platform != "darwin":
+        sys.stderr.write("Sorry, Mac OS Installer Builder is available only on Mac OS system!\n")
+        exit(1)
+
+    if args.command == "serve":
+        from mib.server import serve
+        serve(
+            socket_path=args.socket,
+            workers=args.workers or 2,
+            queue_size=args.queue_size,
+            cache_size=args.cache_size
         )
+        exit(0)
+
+    for config_path in config_paths:
+        try:
+            build_installer(load_config(config_path), base_dir=config_path.resolve().parent)
+        except BuildError as e:
+            sys.stderr.write(f"{e}\n")
+            exit(1)
     exit(0)
 
 
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Build server keeping jinja2 environment and built component packages warm between installer builds.
+
+Protocol is newline delimited json over unix socket. Client sends one request line:
+
+    {"config_path": "/abs/path/mib.toml"}
+    {"config": {...}, "base_dir": "/abs/path"}
+    {"op": "metrics"}
+
+and server streams back events until "done" or "error" event:
+
+    {"event": "queued", "job": "...", "queue_depth": 1}
+    {"event": "progress", "job": "...", "message": "Building component package: ..."}
+    {"event": "done", "job": "...", "installer": "/abs/path/installer.pkg", "elapsed": 1.2}
+"""
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_SOCKET_PATH = Path(os.environ.get("MIB_SOCKET", Path.home() / ".mib" / "mib.sock"))
+FINAL_EVENTS = ("done", "error")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Metrics:
+    """Queue depth, build latency and counters of build server."""
+
+    def __init__(self, window=1000):
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=window)
+        self.waits = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def job_queued(self, queue_size):
+        """Counts job as waiting in queue and returns queue depth, raises QueueFullError if queue is full."""
+        with self._lock:
+            if self.queued >= queue_size:
+                self.rejected += 1
+                raise QueueFullError(f"Build queue is full ({queue_size} builds waiting)")
+            self.queued += 1
+            return self.queued
+
+    def job_started(self, wait):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.waits.append(wait)
+
+    def job_finished(self, latency, success):
+        with self._lock:
+            self.active -= 1
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.latencies.append(latency)
+
+    @staticmethod
+    def _percentile(values, percent):
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def snapshot(self):
+        with self._lock:
+            latencies = list(self.latencies)
+            waits = list(self.waits)
+            return {
+                "queue_depth": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "latency": {
+                    "p50": self._percentile(latencies, 50),
+                    "p95": self._percentile(latencies, 95),
+                    "max": max(latencies, default=None),
+                },
+                "queue_wait": {
+                    "p50": self._percentile(waits, 50),
+                    "p95": self._percentile(waits, 95),
+                },
+            }
+
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+
+    def send(self, event):
+        self.wfile.write(json.dumps(event).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except json.JSONDecodeError as e:
+            self.send({"event": "error", "message": f"Malformed request: {e}"})
+            return
+
+        if not isinstance(request, dict):
+            self.send({"event": "error", "message": "Malformed request: json object expected"})
+            return
+
+        if request.get("op") == "metrics":
+            self.send({"event": "done", "metrics": self.server.metrics_snapshot()})
+            return
+
+        if "config_path" not in request and not ("config" in request and "base_dir" in request):
+            self.send({"event": "error", "message": "Malformed request: config_path or config and base_dir expected"})
+            return
+
+        events = queue.Queue()
+        try:
+            job_id = self.server.submit(request, events.put)
+        except QueueFullError as e:
+            self.send({"event": "error", "message": str(e)})
+            return
+
+        while True:
+            event = events.get()
+            try:
+                self.send(event)
+            except (BrokenPipeError, ConnectionResetError):
+                logger.warning(f"Client of job {job_id} disconnected, build continues")
+                return
+            if event["event"] in FINAL_EVENTS:
+                return
+
+
+class BuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Runs installer builds on bounded worker pool sharing one BuildCache."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=2, queue_size=32, cache_dir=None, cache_size=64):
+        from mib.mib import BuildCache
+
+        self.socket_path = Path(socket_path)
+        # builds run caller supplied scripts and may run installer with sudo, only owner may connect
+        if not self.socket_path.parent.exists():
+            self.socket_path.parent.mkdir(parents=True)
+            os.chmod(self.socket_path.parent, 0o700)
+        self.socket_path.unlink(missing_ok=True)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(str(self.socket_path), BuildRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mib-build")
+        self.cache = BuildCache(cache_dir or self.socket_path.parent / "cache", max_components=cache_size)
+        self.metrics = Metrics()
+
+    def metrics_snapshot(self):
+        return {**self.metrics.snapshot(), "cache": self.cache.stats()}
+
+    def submit(self, request, emit):
+        queue_depth = self.metrics.job_queued(self.queue_size)
+        job_id = uuid.uuid4().hex[:12]
+        emit({"event": "queued", "job": job_id, "queue_depth": queue_depth})
+        self.executor.submit(self._run, job_id, request, emit, time.monotonic())
+        return job_id
+
+    def _run(self, job_id, request, emit, submitted_at):
+        from mib.mib import build_installer, load_config
+
+        started_at = time.monotonic()
+        self.metrics.job_started(started_at - submitted_at)
+        emit({"event": "progress", "job": job_id, "message": "Build started"})
+        success = False
+        try:
+            if "config_path" in request:
+                config_path = Path(request["config_path"])
+                config = load_config(config_path)
+                base_dir = Path(request.get("base_dir") or config_path.parent)
+            else:
+                config = request["config"]
+                base_dir = Path(request["base_dir"])
+            build_dir = base_dir / "build" / job_id
+            try:
+                installer_path = build_installer(
+                    config,
+                    base_dir=base_dir,
+                    build_dir=build_dir,
+                    output_dir=request.get("output_dir"),
+                    cache=self.cache,
+                    progress=lambda message: emit({"event": "progress", "job": job_id, "message": message}),
+                )
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+            success = True
+            emit({
+                "event": "done",
+                "job": job_id,
+                "installer": str(installer_path),
+                "elapsed": time.monotonic() - started_at,
+            })
+        except Exception as e:
+            logger.exception(f"Build {job_id} failed")
+            emit({"event": "error", "job": job_id, "message": f"{type(e).__name__}: {e}"})
+        finally:
+            self.metrics.job_finished(time.monotonic() - submitted_at, success)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        self.socket_path.unlink(missing_ok=True)
+
+
+def serve(socket_path=None, workers=2, queue_size=32, cache_size=64):
+    socket_path = socket_path or DEFAULT_SOCKET_PATH
+    with BuildServer(socket_path, workers=workers, queue_size=queue_size, cache_size=cache_size) as server:
+        logger.warning(f"mib build server listening on {socket_path} ({workers} workers)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def _request(request, socket_path=None):
+    """Sends request to build server and yields events it streams back."""
+    socket_path = socket_path or DEFAULT_SOCKET_PATH
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError as e:
+            yield {"event": "error", "message": f"Can't connect to build server at {socket_path}: {e}"}
+            return
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as stream:
+            for line in stream:
+                event = json.loads(line)
+                yield event
+                if event["event"] in FINAL_EVENTS:
+                    return
+    yield {"event": "error", "message": "Build server closed connection"}
+
+
+def _submit_one(config_path, socket_path, inline, lock):
+    config_path = Path(config_path).resolve()
+    if inline:
+        from mib.mib import load_config
+        request = {"config": load_config(config_path), "base_dir": str(config_path.parent)}
+    else:
+        request = {"config_path": str(config_path)}
+
+    for event in _request(request, socket_path=socket_path):
+        with lock:
+            if event["event"] == "progress":
+                print(f"[{config_path.name}] {event['message']}")
+            elif event["event"] == "queued":
+                print(f"[{config_path.name}] queued as {event['job']} (queue depth: {event['queue_depth']})")
+            elif event["event"] == "done":
+                print(f"[{config_path.name}] built {event['installer']} in {event['elapsed']:.2f}s")
+                return True
+            else:
+                sys.stderr.write(f"[{config_path.name}] {event['message']}\n")
+    return False
+
+
+def submit(config_paths, socket_path=None, inline=False):
+    """Submits builds to build server at once and streams their progress. Returns exit code."""
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max(1, len(config_paths))) as executor:
+        results = list(executor.map(
+            lambda config_path: _submit_one(config_path, socket_path, inline, lock),
+            config_paths
+        ))
+    return 0 if all(results) else 1
+
+
+def show_metrics(socket_path=None):
+    for event in _request({"op": "metrics"}, socket_path=socket_path):
+        if event["event"] == "error":
+            sys.stderr.write(f"{event['message']}\n")
+            return 1
+        print(json.dumps(event["metrics"], indent=2))
+    return 0
@@ -24,7 +24,7 @@ def working_directory(path, cwd=Path.cwd()):
         os.chdir(cwd)
 
 
-def _cmd_exec(command, stdin='', stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+def _cmd_exec(command, stdin='', stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=None):
     """Execute a command."""
     @dataclass
     class _CmdExecResult:
@@ -45,7 +45,7 @@ def _cmd_exec(command, stdin='', stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         command = command.split()
     
     logger.debug(f"executing: {' '.join(command)}")
-    proc = subprocess.Popen(command, stdout=stdout, stderr=stderr, stdin=subprocess.PIPE)
+    proc = subprocess.Popen(command, stdout=stdout, stderr=stderr, stdin=subprocess.PIPE, cwd=cwd)
     (stdout, stderr) = proc.communicate(stdin)
 
     if stderr:
@@ -65,6 +65,7 @@ def cmd_exec(*args, **kwargs):
     stdout = kwargs.pop('stdout', subprocess.PIPE)
     stderr = kwargs.pop('stderr', subprocess.PIPE)
     stdin = ''
+    cwd = kwargs.pop('cwd', None)
     executable = kwargs.pop('executable', None)
     strict_flags_after_args = kwargs.pop('strict_flags_after_args', False)
     as_superuser = kwargs.pop('as_superuser', False)
@@ -110,7 +111,8 @@ def cmd_exec(*args, **kwargs):
         ],
         stdout=stdout,
         stderr=stderr,
-        stdin=stdin
+        stdin=stdin,
+        cwd=cwd
     )
 
 @contextmanager
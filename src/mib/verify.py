@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Post-install verifier driven by build manifest written by mib next to the installer.
+
+Checks every installed file (presence, mode, sha256), package receipts, launchd plist and certificate material.
+All checks run concurrently and are resolved against target root, so installs into fake root can be verified on Linux.
+
+Runs on its own on installed machine (no jinja2, no Python 3.11 needed unless reading toml config):
+
+    python3 -m mib.verify -c mib.toml
+    python3 -m mib.verify -m pikesquares-installer.manifest.json --target-root /tmp/fake-root -o report.json
+"""
+import hashlib
+import json
+import plistlib
+import stat
+import sys
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from xml.parsers.expat import ExpatError
+
+RECEIPTS_DIR = Path("var/db/receipts")
+LAUNCH_DAEMONS_DIR = Path("Library/LaunchDaemons")
+
+
+class CheckFailedError(Exception):
+    pass
+
+
+@dataclass
+class CheckResult:
+    kind: str
+    path: str
+    passed: bool
+    message: str
+    elapsed: float
+
+
+def target_path(target_root, path) -> Path:
+    """Resolves absolute (or ~ relative) install path against target root."""
+    return Path(target_root) / str(Path(path).expanduser()).lstrip("/")
+
+
+def _mode(value) -> int:
+    """Mode from manifest or config: int (toml 0o755) or octal string ("0o755", "755")."""
+    if isinstance(value, int):
+        return value
+    return int(value, 8)
+
+
+def _sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_plist(path) -> dict:
+    with open(path, "rb") as file:
+        plist = plistlib.load(file)
+    if not isinstance(plist, dict):
+        raise CheckFailedError("plist is not a dictionary")
+    return plist
+
+
+def check_file(path, entry):
+    """Checks presence, mode and (when entry has it) sha256 of installed file."""
+    if not path.is_file():
+        raise CheckFailedError("file not installed")
+    mode = stat.S_IMODE(path.stat().st_mode)
+    if entry.get("mode") is not None and mode != _mode(entry["mode"]):
+        raise CheckFailedError(f"mode {oct(mode)}, expected {oct(_mode(entry['mode']))}")
+    if "sha256" not in entry:
+        return "installed"
+    if _sha256(path) != entry["sha256"]:
+        raise CheckFailedError("sha256 mismatch")
+    return "installed"
+
+
+def check_receipt(path, component):
+    if not path.is_file():
+        raise CheckFailedError("package receipt not found")
+    receipt = _load_plist(path)
+    if receipt.get("PackageIdentifier") != component["identifier"]:
+        raise CheckFailedError(f"receipt is for {receipt.get('PackageIdentifier')}")
+    if component.get("version") and receipt.get("PackageVersion") != component["version"]:
+        raise CheckFailedError(f"version {receipt.get('PackageVersion')}, expected {component['version']}")
+    return "package written to packages database"
+
+
+def check_launchd_plist(path, label, run_at_load=None):
+    if not path.is_file():
+        raise CheckFailedError("daemon plist not placed into system daemons folder")
+    daemon = _load_plist(path)
+    if daemon.get("Label") != label:
+        raise CheckFailedError(f"label {daemon.get('Label')}, expected {label}")
+    if run_at_load is not None and bool(daemon.get("RunAtLoad")) != run_at_load:
+        raise CheckFailedError(f"RunAtLoad is {bool(daemon.get('RunAtLoad'))}, expected {run_at_load}")
+    return "daemon placed into system daemons folder"
+
+
+def check_certificate(path):
+    if not path.is_file():
+        raise CheckFailedError("certificate material not installed")
+    if not path.read_bytes().lstrip().startswith(b"-----BEGIN "):
+        raise CheckFailedError("not a PEM file")
+    if path.name.endswith(("-key.pem", ".key")) and path.stat().st_mode & stat.S_IROTH:
+        raise CheckFailedError("private key is world readable")
+    return "certificate material installed"
+
+
+def _checks(manifest, target_root):
+    """Yields (kind, path, check) for everything that should be verified."""
+    for component in manifest.get("components", []):
+        install_location = component.get("install-location", "/")
+        for entry in component.get("files", []):
+            path = target_path(target_root, Path(install_location) / entry["path"])
+            yield "file", path, lambda path=path, entry=entry: check_file(path, entry)
+        path = target_path(target_root, Path("/") / RECEIPTS_DIR / f"{component['identifier']}.plist")
+        yield "receipt", path, lambda path=path, component=component: check_receipt(path, component)
+
+    verify_config = manifest.get("verify", {})
+    # files laid down by scripts are not in component roots, only presence and mode are known for them
+    for entry in verify_config.get("files", []):
+        path = target_path(target_root, entry["path"])
+        yield "file", path, lambda path=path, entry=entry: check_file(path, entry)
+    label = verify_config.get("launchd-label")
+    if label:
+        path = target_path(target_root, Path("/") / LAUNCH_DAEMONS_DIR / f"{label}.plist")
+        run_at_load = verify_config.get("launchd-run-at-load")
+        yield "launchd", path, lambda path=path: check_launchd_plist(path, label, run_at_load)
+    for certificate in verify_config.get("certificates", []):
+        path = target_path(target_root, certificate)
+        yield "certificate", path, lambda path=path: check_certificate(path)
+
+
+def _run_check(kind, path, check):
+    started_at = time.perf_counter()
+    try:
+        message = check()
+        passed = True
+    except (CheckFailedError, OSError, ValueError, ExpatError) as e:
+        # ValueError covers plistlib.InvalidFileException and bad mode values
+        message = str(e) or type(e).__name__
+        passed = False
+    return CheckResult(kind, str(path), passed, message, time.perf_counter() - started_at)
+
+
+def verify(manifest, target_root="/", workers=None) -> dict:
+    """Runs all checks of manifest on thread pool, returns machine readable report."""
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mib-verify") as executor:
+        results = list(executor.map(lambda check: _run_check(*check), _checks(manifest, target_root)))
+    failed = [result for result in results if not result.passed]
+    return {
+        "product": manifest.get("product", {}),
+        "target_root": str(target_root),
+        "passed": not failed,
+        "total": len(results),
+        "failed": len(failed),
+        "elapsed": time.perf_counter() - started_at,
+        "checks": [asdict(result) for result in results],
+    }
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def load_config(config_path):
+    config_path = Path(config_path)
+    with open(config_path, "rb") as file:
+        if config_path.suffix == ".json":
+            return json.load(file)
+        import tomllib
+        return tomllib.load(file)
+
+
+def run(config_path="mib.toml", manifest_path=None, target_root="/", workers=None, output=None) -> int:
+    """Verifies installation, writes json report to output (or stdout) and summary to stderr. Returns exit code."""
+    if manifest_path is None:
+        try:
+            installer_config = load_config(config_path).get("product", {}).get("installer", {})
+        except (OSError, ValueError, ImportError) as e:
+            # ValueError covers json and toml decode errors, ImportError is tomllib on Python < 3.11
+            sys.stderr.write(f"Can't read config {config_path}: {e}\n")
+            return 1
+        manifest_path = Path(config_path).resolve().parent / f"{installer_config.get('file-name')}.manifest.json"
+
+    try:
+        manifest = load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"Can't read build manifest {manifest_path}: {e}\n")
+        return 1
+
+    report = verify(manifest, target_root=target_root, workers=workers)
+    report_json = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(report_json)
+    else:
+        print(report_json)
+    for check in report["checks"]:
+        if not check["passed"]:
+            sys.stderr.write(f"[x] {check['kind']} {check['path']}: {check['message']}\n")
+    sys.stderr.write(
+        f"{report['total'] - report['failed']}/{report['total']} checks passed in {report['elapsed']:.2f}s\n"
+    )
+    return 0 if report["passed"] else 1
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description="Verifies installation against mib build manifest",
+        usage="\n\nExample:\n\tpython3 -m mib.verify --config mib.toml",
+    )
+    parser.add_argument(
+        "-c", "--config",
+        action="store",
+        default="mib.toml",
+        help="mib json (or toml) config, manifest is looked up next to it (<installer file-name>.manifest.json)"
+    )
+    parser.add_argument(
+        "-m", "--manifest",
+        action="store",
+        default=None,
+        help="build manifest to verify installation against"
+    )
+    parser.add_argument(
+        "--target-root",
+        action="store",
+        default="/",
+        help="root of installation to verify"
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        action="store",
+        type=int,
+        default=None,
+        help="verifier worker pool size"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        action="store",
+        default=None,
+        help="write verification report json to this path instead of stdout"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    exit(run(
+        config_path=args.config,
+        manifest_path=args.manifest,
+        target_root=args.target_root,
+        workers=args.workers,
+        output=args.output,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pytest
+
+import mib.mib
+
+DISTRIBUTION_XML = """<?xml version="1.0" encoding="utf-8"?>
+<installer-gui-script minSpecVersion="1"><title>Test</title></installer-gui-script>
+"""
+
+
+@pytest.fixture
+def project(tmp_path):
+    """Minimal mib project: one component, en.lproj resources and templates."""
+    (tmp_path / "_files" / "binary").mkdir(parents=True)
+    binary = tmp_path / "_files" / "binary" / "test-uninstall"
+    binary.write_text("#!/bin/sh\n")
+    binary.chmod(0o755)
+    resources = tmp_path / "_files" / "Resources" / "en.lproj"
+    resources.mkdir(parents=True)
+    (resources / "welcome.html").write_text("not rendered")
+    (resources / "banner.png").write_bytes(b"\x89PNG banner")
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "welcome.html").write_text("Welcome to {{ product.name }} {{ product.version }}")
+    config = {
+        "product": {
+            "name": "Test",
+            "version": "1.0",
+            "identifier": "com.example.test",
+            "installer": {
+                "file-name": "test-installer",
+                "resources-dir": "_files/Resources",
+                "distribution": {"title": "Test Installer"},
+                "files": [{"name": "binary", "root": "_files/binary", "install-location": "/usr/local/bin"}],
+            },
+        },
+    }
+    return tmp_path, config
+
+
+@pytest.fixture
+def fake_tools(monkeypatch):
+    """Replaces pkgbuild/productbuild with functions writing placeholder outputs, returns list of calls."""
+    calls = []
+
+    def fake(*args, cwd=None, **kwargs):
+        calls.append((args, kwargs))
+        output = Path(cwd) / args[0]
+        output.write_text(DISTRIBUTION_XML if output.suffix == ".xml" else "pkg")
+        return mib.utils._cmd_exec(["true"])
+
+    monkeypatch.setattr(mib.mib, "pkgbuild", fake)
+    monkeypatch.setattr(mib.mib, "productbuild", fake)
+    return calls
@@ -0,0 +1,72 @@
+import pytest
+
+from mib.mib import BuildError, discover_locales, fill_templates, template_environment
+
+
+def add_locale(base_dir, locale, welcome):
+    lproj_dir = base_dir / "_files" / "Resources" / f"{locale}.lproj"
+    lproj_dir.mkdir()
+    (lproj_dir / "welcome.html").write_text(welcome)
+    (lproj_dir / "banner.png").write_bytes(b"\x89PNG banner")
+    return lproj_dir
+
+
+def test_discover_locales(project):
+    base_dir, _ = project
+    add_locale(base_dir, "fr", "")
+    resources_dir = base_dir / "_files" / "Resources"
+    assert discover_locales(resources_dir) == {"en": resources_dir / "en.lproj", "fr": resources_dir / "fr.lproj"}
+    assert discover_locales(resources_dir / "en.lproj") == discover_locales(resources_dir)
+
+
+def test_fill_templates_renders_every_locale(project):
+    base_dir, config = project
+    add_locale(base_dir, "fr", '<html lang="fr">Bienvenue dans {{ product.name }}</html>')
+    add_locale(base_dir, "de", "German file replaced by localized template")
+    (base_dir / "templates" / "de.lproj").mkdir()
+    (base_dir / "templates" / "de.lproj" / "welcome.html").write_text("Willkommen zu {{ product.name }} {{ locale }}")
+    resources_dir = base_dir / "_files" / "Resources"
+    # own files without template are rendered the same way in every locale
+    (resources_dir / "en.lproj" / "extra.html").write_text("Extra {{ product.name }} {{ locale }}")
+    (resources_dir / "fr.lproj" / "extra.html").write_text("En plus {{ product.name }} {{ locale }}")
+    (resources_dir / "fr.lproj" / "data.bin").write_bytes(b"\xff\xfe{{ binary")
+    # dirs which are not *.lproj are shared assets, not locales
+    (resources_dir / "images").mkdir()
+    (resources_dir / "images" / "logo.html").write_text("{{ not rendered }}")
+
+    build_resources_dir = fill_templates(
+        resources_dir,
+        base_dir / "build" / "Resources",
+        values={"product": config["product"]},
+        locales_values={"fr": {"product": {"name": "Le Test"}}},
+        environment=template_environment(base_dir / "templates"),
+    )
+
+    # default locale uses base template, others use localized template or their own translated file
+    assert (build_resources_dir / "en.lproj" / "welcome.html").read_text() == "Welcome to Test 1.0"
+    assert (build_resources_dir / "de.lproj" / "welcome.html").read_text() == "Willkommen zu Test de"
+    assert (build_resources_dir / "fr.lproj" / "welcome.html").read_text() == (
+        '<html lang="fr">Bienvenue dans Le Test</html>'
+    )
+    assert (build_resources_dir / "en.lproj" / "extra.html").read_text() == "Extra Test en"
+    assert (build_resources_dir / "fr.lproj" / "extra.html").read_text() == "En plus Le Test fr"
+    assert (build_resources_dir / "fr.lproj" / "data.bin").read_bytes() == b"\xff\xfe{{ binary"
+    assert (build_resources_dir / "images" / "logo.html").read_text() == "{{ not rendered }}"
+    assert (resources_dir / "en.lproj" / "welcome.html").read_text() == "not rendered"
+
+    banners = [build_resources_dir / f"{locale}.lproj" / "banner.png" for locale in ("en", "fr", "de")]
+    assert len({banner.stat().st_ino for banner in banners}) == 1
+    assert banners[0].read_bytes() == b"\x89PNG banner"
+
+
+def test_fill_templates_fails_on_broken_translation(project):
+    base_dir, config = project
+    add_locale(base_dir, "es", "Bienvenido a {% broken")
+
+    with pytest.raises(BuildError, match="es.lproj/welcome.html"):
+        fill_templates(
+            base_dir / "_files" / "Resources",
+            base_dir / "build" / "Resources",
+            values={"product": config["product"]},
+            environment=template_environment(base_dir / "templates"),
+        )
@@ -0,0 +1,114 @@
+import json
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+import mib.mib
+from mib.mib import BuildCache, build_installer
+from mib.server import BuildServer, Metrics, QueueFullError
+
+
+def test_metrics_queue_and_latency():
+    metrics = Metrics()
+    assert metrics.job_queued(queue_size=2) == 1
+    assert metrics.job_queued(queue_size=2) == 2
+    with pytest.raises(QueueFullError):
+        metrics.job_queued(queue_size=2)
+
+    metrics.job_started(wait=0.1)
+    metrics.job_finished(latency=1.0, success=True)
+    metrics.job_started(wait=0.3)
+    metrics.job_finished(latency=3.0, success=False)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["queue_depth"] == 0
+    assert snapshot["active"] == 0
+    assert (snapshot["completed"], snapshot["failed"], snapshot["rejected"]) == (1, 1, 1)
+    assert snapshot["latency"]["max"] == 3.0
+    assert snapshot["queue_wait"]["p50"] in (0.1, 0.3)
+
+
+def test_build_cache_evicts_least_recently_used(tmp_path):
+    cache = BuildCache(tmp_path / "cache", max_components=2)
+    pkg = tmp_path / "component.pkg"
+    pkg.write_text("pkg")
+
+    for mtime, key in enumerate(["a", "b"]):
+        cache.store_component(key, pkg, files=[])
+        os.utime(cache.directory / f"{key}.pkg", ns=(mtime, mtime))
+    assert cache.component("a", tmp_path / "a.pkg") == []  # "a" becomes most recently used
+    cache.store_component("c", pkg, files=[])
+
+    assert sorted(path.name for path in cache.directory.iterdir()) == ["a.json", "a.pkg", "c.json", "c.pkg"]
+    assert cache.component("b", tmp_path / "b.pkg") is None
+    assert not (tmp_path / "b.pkg").exists()
+    assert cache.stats()["components"] == {"hits": 1, "misses": 1}
+
+
+def test_build_cache_counts_compiled_template_reuse(tmp_path):
+    (tmp_path / "templates").mkdir()
+    template = tmp_path / "templates" / "welcome.html"
+    template.write_text("v1")
+    environment = mib.mib.template_environment(tmp_path / "templates")
+    cache = BuildCache(tmp_path / "cache")
+
+    for _ in range(2):
+        mib.mib.fill_template(template, {}, environment=environment, cache=cache, output_path=tmp_path / "out.html")
+    template.write_text("v2 changed")
+    os.utime(template, ns=(0, 0))  # jinja2 auto_reload compares mtime
+    mib.mib.fill_template(template, {}, environment=environment, cache=cache, output_path=tmp_path / "out.html")
+
+    assert (tmp_path / "out.html").read_text() == "v2 changed"
+    assert cache.stats()["templates"] == {"hits": 1, "misses": 2}
+
+
+@pytest.fixture
+def server(tmp_path):
+    build_server = BuildServer(tmp_path / "mib" / "mib.sock", workers=1)
+    thread = threading.Thread(target=build_server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield build_server
+    build_server.shutdown()
+    build_server.server_close()
+
+
+def request_events(socket_path, line):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(line + b"\n")
+        with sock.makefile("rb") as stream:
+            return [json.loads(event) for event in stream]
+
+
+def test_server_socket_is_owner_only(server):
+    assert stat.S_IMODE(server.socket_path.stat().st_mode) == 0o600
+    assert stat.S_IMODE(server.socket_path.parent.stat().st_mode) == 0o700
+
+
+@pytest.mark.parametrize("line", [b"[]", b'"x"', b"1", b"{}", b'{"config": {}}', b"not json"])
+def test_server_rejects_malformed_requests(server, line):
+    (event,) = request_events(server.socket_path, line)
+    assert event["event"] == "error"
+    assert event["message"].startswith("Malformed request")
+    assert server.metrics.snapshot()["queue_depth"] == 0
+    assert server.metrics.snapshot()["completed"] + server.metrics.snapshot()["failed"] == 0
+
+
+def test_build_installer_uses_project_templates_and_cache(project, fake_tools, monkeypatch, tmp_path_factory):
+    base_dir, config = project
+    # templates must come from project, not from working directory of the process
+    monkeypatch.chdir(tmp_path_factory.mktemp("elsewhere"))
+    cache = BuildCache(base_dir / "cache")
+
+    installer_path = build_installer(config, base_dir=base_dir, cache=cache)
+    build_installer(config, base_dir=base_dir, cache=cache)
+
+    assert installer_path == base_dir / "test-installer.pkg"
+    welcome = base_dir / "build" / "Resources" / "en.lproj" / "welcome.html"
+    assert welcome.read_text() == "Welcome to Test 1.0"
+    assert [args[0] for args, _ in fake_tools].count("Test-binary.pkg") == 1
+    assert cache.stats()["components"] == {"hits": 1, "misses": 1}
+    assert mib.mib.template_environment(base_dir / "templates") is mib.mib.template_environment(base_dir / "templates")